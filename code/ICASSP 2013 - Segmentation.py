@@ -3,6 +3,8 @@
 
 # <codecell>
 
+from __future__ import print_function
+
 import mir_eval
 import sys
 import os
@@ -36,7 +38,7 @@ def evaluate_set(SETNAME, agg=True):
     
     scores = {}
     for A in algos:
-        print 'Scoring %s...' % A
+        print('Scoring %s...' % A)
         # Load the corresponding predictions
         predictions = load_annotations('%s/predictions/%s/%s/*' % (ROOTPATH, SETNAME, A))
         
@@ -155,13 +157,13 @@ def get_top_sig(SETNAME, perfs, idx, p=0.05):
         
         
     # Print the results
-    ordering = [(v, k) for k, v in mean.iteritems()]
+    ordering = [(v, k) for k, v in mean.items()]
     ordering.sort(reverse=True)
     
-    print '%s\t%s' % (METRICS[idx], SETNAME)
+    print('%s\t%s' % (METRICS[idx], SETNAME))
     
     for (v, k) in ordering:
-        print '%.3f\t%10s\t%.3e\t%r' % (v, k, sigdiff[k], sigdiff[k] * (n_algs -1) < p)
+        print('%.3f\t%10s\t%.3e\t%r' % (v, k, sigdiff[k], sigdiff[k] * (n_algs -1) < p))
 
 # <codecell>
 
@@ -171,9 +173,9 @@ def get_worst_examples(SETNAME, perfs, algorithm, idx, k=10):
     
     indices = np.argsort(perfs[algorithm][:, idx])[:k]
     
-    print '%s\t%s\t%s' % (METRICS[idx], SETNAME, algorithm)
+    print('%s\t%s\t%s' % (METRICS[idx], SETNAME, algorithm))
     for v in indices:
-        print '%.3f\t%s' % (perfs[algorithm][v, idx], files[v])
+        print('%.3f\t%s' % (perfs[algorithm][v, idx], files[v]))
 
 # <codecell>
 
@@ -199,7 +201,7 @@ del ind_perfs_beatles['rfda']
 #for idx in range(len(METRICS)):
 for idx in [2, 5]:
     get_top_sig('BEATLES', ind_perfs_beatles, idx=idx)
-    print
+    print()
 
 # <codecell>
 
@@ -209,7 +211,7 @@ plot_boxes(ind_perfs_beatles)
 
 for alg in sorted(ind_perfs_beatles.keys()):
     get_worst_examples('BEATLES', ind_perfs_beatles, alg, 2, 10)
-    print
+    print()
 
 # <codecell>
 
@@ -230,7 +232,7 @@ save_results('/home/bmcfee/git/olda/data/final_salami_scores.csv', perfs_salami)
 
 for alg in sorted(ind_perfs_salami.keys()):
     get_worst_examples('SALAMI', ind_perfs_salami, alg, 2, 5)
-    print
+    print()
 
 # <codecell>
 
@@ -241,7 +243,7 @@ del ind_perfs_salami['rfda']
 #for idx in range(len(METRICS)):
 for idx in [2, 5]:
     get_top_sig('SALAMI', ind_perfs_salami, idx=idx)
-    print
+    print()
 
 # <codecell>
 
@@ -411,7 +413,7 @@ ylabel('SALAMI: OLDA')
 colorbar(orientation='horizontal', use_gridspec=True )
 #ylabel("More important $\\rightarrow$")
 yticks([])
-xticks([0, 32, 44, 76, 108], ['MFCC', '$\uparrow$\nChroma', 'R-MFCC', 'R-Chroma', 'Time'], horizontalalignment='left')
+xticks([0, 32, 44, 76, 108], ['MFCC', '$\\uparrow$\nChroma', 'R-MFCC', 'R-Chroma', 'Time'], horizontalalignment='left')
 
 tight_layout()
 #savefig('/home/bmcfee/git/olda/paper/figs/w.pdf', format='pdf', pad_inches=0, transparent=True)
@@ -440,14 +442,14 @@ subplot(223)
 imshow(model_olda_beatles, aspect='auto', interpolation='none', cmap='PRGn_r')
 ylabel('OLDA - Beatles')
 yticks([])
-xticks([0, 32, 44, 76, 108], ['MFCC', '$\uparrow$\nChroma', 'R-MFCC', 'R-Chroma', 'Time'], horizontalalignment='left')
+xticks([0, 32, 44, 76, 108], ['MFCC', '$\\uparrow$\nChroma', 'R-MFCC', 'R-Chroma', 'Time'], horizontalalignment='left')
 
 subplot(224)
 imshow(model_olda_salami, aspect='auto', interpolation='none', cmap='PRGn_r')
 ylabel('OLDA - Salami')
 yticks([])
 xticks([])
-xticks([0, 32, 44, 76, 108], ['MFCC', '$\uparrow$\nChroma', 'R-MFCC', 'R-Chroma', 'Time'], horizontalalignment='left')
+xticks([0, 32, 44, 76, 108], ['MFCC', '$\\uparrow$\nChroma', 'R-MFCC', 'R-Chroma', 'Time'], horizontalalignment='left')
 
 tight_layout()
 #savefig('/home/bmcfee/git/olda/paper/figs/fda-vs-olda.pdf', format='pdf', pad_inches=0, transparent=True)
@@ -520,7 +522,9 @@ def rep_feature_svd(M):
     S_hat = np.zeros(U.shape[1])
     S_hat[:D_little] = sigma[:D_little]
     
-    R_reconst = U.dot(np.diag(S_hat))
+    # Scale the columns directly instead of multiplying by a dense
+    # diagonal matrix
+    R_reconst = U * S_hat[np.newaxis, :]
     R_reconst = R_reconst[:, :Vh.shape[0]].dot(Vh)
     
     figure(figsize=(12,6))
@@ -2,7 +2,10 @@
 #
 # Ordinal LDA
 
-import itertools
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
 import numpy as np
 import scipy.linalg
 from sklearn.base import BaseEstimator, TransformerMixin
@@ -66,7 +69,7 @@ class OLDA(BaseEstimator, TransformerMixin):
         self : object
         '''
         
-        for (xi, yi) in itertools.izip(X, Y):
+        for (xi, yi) in izip(X, Y):
             
             prev_mean       = None
             prev_length     = None
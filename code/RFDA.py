@@ -3,7 +3,10 @@
 # Restricted FDA
 #   only compute between-class scatter within each song
 
-import itertools
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
 import numpy as np
 import scipy.linalg
 from sklearn.base import BaseEstimator, TransformerMixin
@@ -66,7 +69,7 @@ class RFDA(BaseEstimator, TransformerMixin):
         self : object
         '''
         
-        for (xi, yi) in itertools.izip(X, Y):
+        for (xi, yi) in izip(X, Y):
             
             if self.scatter_within_ is None:
                 # First round: initialize
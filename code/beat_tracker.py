@@ -9,6 +9,8 @@ If run as a program, usage is:
 '''
 
 
+from __future__ import print_function
+
 import sys
 import os
 import argparse
@@ -49,7 +51,7 @@ def get_beats(filename):
         odf = odf / odf.max()
         return odf
     
-    print '\t[1/2] loading audio'
+    print('\t[1/2] loading audio')
     # Load the waveform
     y, sr = librosa.load(filename, sr=SR)
 
@@ -66,7 +68,7 @@ def get_beats(filename):
     # Put on a log scale
     S = librosa.logamplitude(S)
     
-    print '\t[2/2] detecting beats'
+    print('\t[2/2] detecting beats')
     # Get the beats
     bpm, beats = librosa.beat.beat_track(onsets=onset(S), 
                                             sr=SR, 
@@ -95,12 +97,12 @@ if __name__ == '__main__':
     parameters = process_arguments()
 
     # Load the features
-    print '- ', os.path.basename(parameters['input_song'])
+    print('- ', os.path.basename(parameters['input_song']))
 
     beats, beat_times   = get_beats(parameters['input_song'])
 
     # Output lab file
-    print '\tsaving output to ', parameters['output_file']
+    print('\tsaving output to ', parameters['output_file'])
     librosa.output.frames_csv(parameters['output_file'], beats, sr=SR, hop_length=HOP)
 
     pass
@@ -9,7 +9,7 @@ def onetotwo(input_file, output_file):
 
     times = mir_eval.util.import_segment_boundaries(input_file, cols=[0])
 
-    new_times = zip(times[:-1], times[1:])
+    new_times = np.column_stack((times[:-1], times[1:]))
 
     np.savetxt(output_file, new_times, fmt='%.8f', delimiter='\t')
     return
@@ -11,7 +11,7 @@ def load_json(infile):
         data = json.load(f)['sections']
 
 
-    times = map(lambda x: x['start'], filter(lambda x: x['bound'], data))
+    times = [x['start'] for x in data if x['bound']]
     times.append(0)
     times.sort()
     return np.array(times)
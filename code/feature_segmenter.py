@@ -9,19 +9,22 @@ If run as a program, usage is:
 '''
 
 
+from __future__ import print_function
+
 import sys
 import os
 import argparse
 
-import cPickle as pickle
 import numpy as np
 
+from joblib import load
+
 import segmenter
 
 def features(input_song):
 
-    with open(input_song, 'r') as f:
-        data = pickle.load(f)
+    # joblib reads both its own compressed dumps and legacy plain pickles
+    data = load(input_song)
 
     return data['features'], data['segment_times'], data['beats']
 
@@ -72,16 +75,16 @@ if __name__ == '__main__':
     parameters = process_arguments()
 
     # Load the features
-    print '- ', os.path.basename(parameters['input_song'])
+    print('- ', os.path.basename(parameters['input_song']))
 
     X, Y, beats    = features(parameters['input_song'])
     # Load the transformation
     W           = segmenter.load_transform(parameters['transform'])
-    print '\tapplying transformation...'
+    print('\tapplying transformation...')
     X           = W.dot(X)
 
     # Find the segment boundaries
-    print '\tpredicting segments...'
+    print('\tpredicting segments...')
     if parameters['gnostic']:
         S           = segmenter.get_segments(X, kmin=len(Y)-1, kmax=len(Y))
     elif parameters['dynamic']:
@@ -91,7 +94,7 @@ if __name__ == '__main__':
         S           = segmenter.get_segments(X)
 
     # Output lab file
-    print '\tsaving output to ', parameters['output_file']
+    print('\tsaving output to ', parameters['output_file'])
     segmenter.save_segments(parameters['output_file'], S, beats)
 
     pass
@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import sys
 import argparse
 import numpy as np
 
 import mir_eval
-import cPickle as pickle
 
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, load
 
 import RFDA
 import segmenter
@@ -36,14 +37,13 @@ def process_arguments():
 
 def load_data(input_file):
 
-    with open(input_file, 'r') as f:
-        #   X = features
-        #   Y = segment boundaries (as beat numbers)
-        #   B = beat timings
-        #   T = true segment boundaries (seconds)
-        #   F = filename
+    #   X = features
+    #   Y = segment boundaries (as beat numbers)
+    #   B = beat timings
+    #   T = true segment boundaries (seconds)
+    #   F = filename
 
-        X, Y, B, T = pickle.load(f)[:4]
+    X, Y, B, T = load(input_file)[:4]
 
     return X, Y, B, T
 
@@ -57,7 +57,9 @@ def score_model(model, x, b, t):
 
     # Then, run the segmenter
     kmin, kmax = segmenter.get_num_segs(b[-1])
-    boundary_beats = segmenter.get_segments(xt, kmin=kmin, kmax=kmax)
+    # Workers here are one process per song already; keep the inner
+    # k-sweep serial so we don't oversubscribe the machine
+    boundary_beats = segmenter.get_segments(xt, kmin=kmin, kmax=kmax, n_jobs=1)
 
     if len(boundary_beats) < 2 or len(t) < 2:
         return 0.0
@@ -85,14 +87,14 @@ def fit_model(X, Y, B, T, n_jobs):
         scores = Parallel(n_jobs=n_jobs)( delayed(score_model)(O.components_, *z) for z in zip(X, B, T))
 
         mean_score = np.mean(scores)
-        print 'Sigma=%.2e, score=%.3f' % (sig, mean_score)
+        print('Sigma=%.2e, score=%.3f' % (sig, mean_score))
 
         if mean_score > best_score:
             best_score  = mean_score
             best_sigma  = sig
             model       = O.components_
 
-    print 'Best sigma: %.2e' % best_sigma
+    print('Best sigma: %.2e' % best_sigma)
     return model
 
 if __name__ == '__main__':
@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import numpy as np
 import glob
 import os
 import sys
+import threading
 
-from joblib import Parallel, delayed
-import cPickle as pickle
+from joblib import Parallel, delayed, Memory, dump
 
 # Needs the most recent mir_eval and librosa development branch
 import mir_eval
 import librosa
 
-from segmenter import features
+from segmenter import features, load_audio
 
 def get_all_files(basedir, ext='.wav'):
     for root, dirs, files in os.walk(basedir, followlinks=True):
@@ -44,25 +46,19 @@ def align_segmentation(filename, beat_times):
     segment_times, segment_labels = mir_eval.io.load_annotation(filename)
 
     # Compute beat intervals
-    beat_intervals = np.asarray(zip(beat_times[:-1], beat_times[1:]))
+    beat_intervals = np.column_stack((beat_times[:-1], beat_times[1:]))
 
     # Map beats to segments
     beat_segment_ids  = librosa.util.match_intervals(beat_intervals, segment_times)
 
-    # Now, find the first beat mapping to each segment
-    segment_beats = []
-    segment_times_out = []
-    segment_labels_out = []
-    for i in range(segment_times.shape[0]):
-        hits = np.argwhere(beat_segment_ids == i)
-        if len(hits) > 0:
-            segment_beats.extend( hits[0] )
-            segment_times_out.append(segment_times[i,:])
-            segment_labels_out.append(segment_labels[i])
+    # Now, find the first beat mapping to each segment in a single pass
+    ids, first_beat = np.unique(beat_segment_ids, return_index=True)
+
+    segment_beats      = first_beat.tolist()
+    segment_labels_out = [segment_labels[i] for i in ids]
 
     # Pull out the segment-start times
-    segment_beats = list(segment_beats)
-    segment_times_out = np.asarray(segment_times_out)[:, 0].squeeze()
+    segment_times_out = segment_times[ids, 0].squeeze()
 
     if segment_times_out.ndim == 0:
         segment_times_out = segment_times_out[np.newaxis]
@@ -71,38 +67,82 @@ def align_segmentation(filename, beat_times):
 
 # <codecell>
 
-def import_data(audio, label, rootpath, output_path):
+def compute_features(audio, label, y_sr=None):
+    '''Feature extraction and annotation alignment for a single song'''
+
+    X, B    = features(audio, y_sr=y_sr)
+    Y, T, L = align_segmentation(label, B)
+
+    return X, B, Y, T, L
+
+# <codecell>
+
+def import_data(audio, label, output_path, compute, y_sr=None):
         data_file = '%s/features/BEATLES/%s.pickle' % (output_path, os.path.splitext(os.path.basename(audio))[0])
 
-        if os.path.exists(data_file):
-            with open(data_file, 'r') as f:
-                Data = pickle.load(f)
-                print audio, 'cached!'
-        else:
-            try:
-                X, B     = features(audio)
-                Y, T, L  = align_segmentation(label, B)
-                
-                Data = {'features':         X, 
-                        'beats':            B, 
-                        'filename':         audio, 
-                        'segment_times':    T,
-                        'segment_labels':   L,
-                        'segments':         Y}
-
-                print audio, 'processed!'
-        
-                with open(data_file, 'w') as f:
-                    pickle.dump( Data, f )
-            except Exception as e:
-                print audio, 'failed!'
-                print e
-                Data = None
+        try:
+            X, B, Y, T, L = compute(audio, label, y_sr=y_sr)
+
+            Data = {'features':         X,
+                    'beats':            B,
+                    'filename':         audio,
+                    'segment_times':    T,
+                    'segment_labels':   L,
+                    'segments':         Y}
+
+            # Materialize the per-song dict consumed by feature_segmenter
+            if not os.path.exists(data_file):
+                dump(Data, data_file, compress=3)
+
+            print(audio, 'processed!')
+        except Exception as e:
+            print(audio, 'failed!')
+            print(e)
+            Data = None
 
         return Data
 
 # <codecell>
 
+def import_chunk(pairs, output_path, compute):
+    '''Process a chunk of (audio, label) pairs, decoding the next song's
+    audio in a background thread while the current song is being computed.'''
+
+    prefetched = {}
+
+    def prefetch(audio):
+        def run():
+            try:
+                prefetched[audio] = load_audio(audio)
+            except Exception:
+                prefetched[audio] = None
+
+        t = threading.Thread(target=run)
+        t.start()
+        return t
+
+    loader  = None
+    results = []
+    for i, (audio, label) in enumerate(pairs):
+        if loader is not None:
+            loader.join()
+
+        y_sr = prefetched.pop(audio, None)
+
+        # Only decode ahead when the next song will actually be computed;
+        # on a warm cache the audio is never touched
+        loader = None
+        if i + 1 < len(pairs):
+            next_audio, next_label = pairs[i + 1]
+            if not compute.check_call_in_cache(next_audio, next_label):
+                loader = prefetch(next_audio)
+
+        results.append(import_data(audio, label, output_path, compute, y_sr=y_sr))
+
+    return results
+
+# <codecell>
+
 def make_dataset(n=None, n_jobs=16, rootpath='beatles/', output_path='data/'):
     
     F_audio     = sorted([_ for _ in get_all_files(os.path.join(rootpath, 'audio'), '.wav')])
@@ -112,19 +152,38 @@ def make_dataset(n=None, n_jobs=16, rootpath='beatles/', output_path='data/'):
     if n is None:
         n = len(F_audio)
 
-    data = Parallel(n_jobs=n_jobs)(delayed(import_data)(audio, label, rootpath, output_path) for (audio, label) in zip(F_audio[:n], F_labels[:n]))
-    
-    X, Y, B, T, F, L = [], [], [], [], [], []
-    for d in data:
-        if d is None:
-            continue
-        X.append(d['features'])
-        Y.append(d['segments'])
-        B.append(d['beats'])
-        T.append(d['segment_times'])
-        F.append(d['filename'])
-        L.append(d['segment_labels'])
+    # Memoize feature extraction on disk: cache hits come back through
+    # np.load with mmap_mode='r', so repeated runs and parallel workers
+    # share pages instead of re-reading full pickles
+    memory  = Memory(location='%s/features/BEATLES' % output_path, mmap_mode='r', verbose=0)
+    compute = memory.cache(compute_features, ignore=['y_sr'])
+
+    # One contiguous run of songs per worker, so each worker can overlap
+    # the next song's decode with the current song's compute while the
+    # gathered results keep the sorted song order
+    pairs      = list(zip(F_audio[:n], F_labels[:n]))
+    chunk_size = max(1, -(-len(pairs) // n_jobs))
+    chunks     = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+
+    data = Parallel(n_jobs=n_jobs,
+                    backend='loky',
+                    batch_size='auto',
+                    max_nbytes='1M',
+                    temp_folder='%s/jl_tmp' % output_path)(delayed(import_chunk)(chunk, output_path, compute) for chunk in chunks)
+
+    data = [d for chunk in data for d in chunk]
     
+    # Gather the per-song results struct-of-lists style with a single
+    # transpose instead of six append loops
+    rows = [(d['features'], d['segments'], d['beats'],
+             d['segment_times'], d['filename'], d['segment_labels'])
+            for d in data if d is not None]
+
+    if not rows:
+        return [], [], [], [], [], []
+
+    X, Y, B, T, F, L = (list(_) for _ in zip(*rows))
+
     return X, Y, B, T, F, L
 
 
@@ -132,5 +191,6 @@ if __name__ == '__main__':
     beatles_path = sys.argv[1]
     output_path = sys.argv[2]
     X, Y, B, T, F, L = make_dataset(rootpath=beatles_path, output_path=output_path)
-    with open('%s/beatles_data.pickle' % output_path, 'w') as f:
-        pickle.dump( (X, Y, B, T, F, L), f)
+    # Compressed binary dump: numpy arrays go through np.save rather
+    # than protocol-0 ASCII pickling
+    dump((X, Y, B, T, F, L), '%s/beatles_data.pickle' % output_path, compress=3)
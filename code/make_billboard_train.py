@@ -1,16 +1,18 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import numpy as np
 import glob
 import os
 import sys
+import threading
 
-from joblib import Parallel, delayed
-import cPickle as pickle
+from joblib import Parallel, delayed, Memory, dump
 
 import mir_eval
 
-from segmenter import features
+from segmenter import features, load_audio
 
 def align_segmentation(filename, beat_times):
     '''Load a ground-truth segmentation, and align times to the nearest detected beats
@@ -32,11 +34,10 @@ def align_segmentation(filename, beat_times):
     
     segment_times, segment_labels = mir_eval.io.load_events(filename)
 
-    segment_beats = []
-    for t in segment_times:
-        # Find the closest beat
-        segment_beats.append( np.argmin((beat_times - t)**2))
-        
+    # Find the closest beat to each segment boundary in one vectorized pass
+    segment_beats = np.argmin(np.abs(beat_times[np.newaxis, :] - segment_times[:, np.newaxis]),
+                              axis=1).tolist()
+
     return segment_beats, segment_times, segment_labels
 
 # <codecell>
@@ -47,37 +48,82 @@ def get_annotation(song, rootpath):
 
 # <codecell>
 
-def import_data(song, rootpath, output_path):
+def compute_features(song, annotation, y_sr=None):
+    '''Feature extraction and annotation alignment for a single song'''
+
+    X, B    = features(song, y_sr=y_sr)
+    Y, T, L = align_segmentation(annotation, B)
+
+    return X, B, Y, T, L
+
+# <codecell>
+
+def import_data(song, rootpath, output_path, compute, y_sr=None):
         data_file = '%s/features/BILLBOARD/%s.pickle' % (output_path, os.path.splitext(os.path.basename(song))[0])
 
-        if os.path.exists(data_file):
-            with open(data_file, 'r') as f:
-                Data = pickle.load(f)
-                print song, 'cached!'
-        else:
-            try:
-                X, B     = features(song)
-                Y, T, L  = align_segmentation(get_annotation(song, rootpath), B)
-                
-                Data = {'features': X, 
-                        'beats': B, 
-                        'filename': song, 
-                        'segment_times': T,
-                        'segment_labels': L,
-                        'segments': Y}
-                print song, 'processed!'
-        
-                with open(data_file, 'w') as f:
-                    pickle.dump( Data, f )
-            except Exception as e:
-                print song, 'failed!'
-                print e
-                Data = None
+        try:
+            X, B, Y, T, L = compute(song, get_annotation(song, rootpath), y_sr=y_sr)
+
+            Data = {'features': X,
+                    'beats': B,
+                    'filename': song,
+                    'segment_times': T,
+                    'segment_labels': L,
+                    'segments': Y}
+
+            # Materialize the per-song dict consumed by feature_segmenter
+            if not os.path.exists(data_file):
+                dump(Data, data_file, compress=3)
+
+            print(song, 'processed!')
+        except Exception as e:
+            print(song, 'failed!')
+            print(e)
+            Data = None
 
         return Data
 
 # <codecell>
 
+def import_chunk(songs, rootpath, output_path, compute):
+    '''Process a chunk of songs, decoding the next song's audio in a
+    background thread while the current song is being computed.'''
+
+    prefetched = {}
+
+    def prefetch(song):
+        def run():
+            try:
+                prefetched[song] = load_audio(song)
+            except Exception:
+                prefetched[song] = None
+
+        t = threading.Thread(target=run)
+        t.start()
+        return t
+
+    loader  = None
+    results = []
+    for i, song in enumerate(songs):
+        if loader is not None:
+            loader.join()
+
+        y_sr = prefetched.pop(song, None)
+
+        # Only decode ahead when the next song will actually be computed;
+        # on a warm cache the audio is never touched
+        loader = None
+        if i + 1 < len(songs):
+            next_song = songs[i + 1]
+            if not compute.check_call_in_cache(next_song, get_annotation(next_song, rootpath)):
+                loader = prefetch(next_song)
+
+        results.append(import_data(song, rootpath, output_path, compute, y_sr=y_sr))
+
+    return results
+
+# <codecell>
+
 def make_dataset(n=None, n_jobs=16, rootpath='BILLBOARD/', output_path='data/'):
     
     EXTS = ['m4a']
@@ -88,19 +134,38 @@ def make_dataset(n=None, n_jobs=16, rootpath='BILLBOARD/', output_path='data/'):
     if n is None:
         n = len(files)
 
-    data = Parallel(n_jobs=n_jobs)(delayed(import_data)(song, rootpath, output_path) for song in files[:n])
-    
-    X, Y, B, T, F, L = [], [], [], [], [], []
-    for d in data:
-        if d is None:
-            continue
-        X.append(d['features'])
-        Y.append(d['segments'])
-        B.append(d['beats'])
-        T.append(d['segment_times'])
-        F.append(d['filename'])
-        L.append(d['segment_labels'])
+    # Memoize feature extraction on disk: cache hits come back through
+    # np.load with mmap_mode='r', so repeated runs and parallel workers
+    # share pages instead of re-reading full pickles
+    memory  = Memory(location='%s/features/BILLBOARD' % output_path, mmap_mode='r', verbose=0)
+    compute = memory.cache(compute_features, ignore=['y_sr'])
+
+    # One contiguous run of songs per worker, so each worker can overlap
+    # the next song's decode with the current song's compute while the
+    # gathered results keep the sorted song order
+    songs      = files[:n]
+    chunk_size = max(1, -(-len(songs) // n_jobs))
+    chunks     = [songs[i:i + chunk_size] for i in range(0, len(songs), chunk_size)]
+
+    data = Parallel(n_jobs=n_jobs,
+                    backend='loky',
+                    batch_size='auto',
+                    max_nbytes='1M',
+                    temp_folder='%s/jl_tmp' % output_path)(delayed(import_chunk)(chunk, rootpath, output_path, compute) for chunk in chunks)
+
+    data = [d for chunk in data for d in chunk]
     
+    # Gather the per-song results struct-of-lists style with a single
+    # transpose instead of six append loops
+    rows = [(d['features'], d['segments'], d['beats'],
+             d['segment_times'], d['filename'], d['segment_labels'])
+            for d in data if d is not None]
+
+    if not rows:
+        return [], [], [], [], [], []
+
+    X, Y, B, T, F, L = (list(_) for _ in zip(*rows))
+
     return X, Y, B, T, F, L
 
 
@@ -108,5 +173,6 @@ if __name__ == '__main__':
     billboard_path = sys.argv[1]
     output_path = sys.argv[2]
     X, Y, B, T, F, L = make_dataset(rootpath=billboard_path, output_path=output_path)
-    with open('%s/billboard_data.pickle' % output_path, 'w') as f:
-        pickle.dump( (X, Y, B, T, F, L), f)
+    # Compressed binary dump: numpy arrays go through np.save rather
+    # than protocol-0 ASCII pickling
+    dump((X, Y, B, T, F, L), '%s/billboard_data.pickle' % output_path, compress=3)
@@ -1,17 +1,19 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import numpy as np
 import glob
 import os
 import sys
+import threading
 
-from joblib import Parallel, delayed
-import cPickle as pickle
+from joblib import Parallel, delayed, Memory, dump
 
 import mir_eval
 import librosa
 
-from segmenter import features
+from segmenter import features, load_audio
 
 def align_segmentation(filename, beat_times):
     '''Load a ground-truth segmentation, and align times to the nearest detected beats
@@ -34,32 +36,21 @@ def align_segmentation(filename, beat_times):
     segment_times, segment_labels = mir_eval.io.load_events(filename)
 
     # Map to intervals, clip the last label marker
-    segment_intervals = np.asarray(zip(segment_times[:-1], segment_times[1:]))
+    segment_intervals = np.column_stack((segment_times[:-1], segment_times[1:]))
     segment_labels    = segment_labels[:-1]
 
     # Map beats to intervals
-    beat_intervals    = np.asarray(zip(beat_times[:-1], beat_times[1:]))
+    beat_intervals    = np.column_stack((beat_times[:-1], beat_times[1:]))
 
     # Map beats to segments
     beat_segment_ids  = librosa.util.match_intervals(beat_intervals, segment_intervals)
 
-    segment_beats = []
-    segment_times_out = []
-    segment_labels_out = []
-
-    for i in range(segment_times.shape[0]):
-        hits = np.argwhere(beat_segment_ids == i)
-        if len(hits) > 0:
-            segment_beats.extend(hits[0])
-            segment_times_out.append(segment_intervals[i,:])
-            segment_labels_out.append(segment_labels[i])
+    # Find the first beat mapping to each segment in a single pass
+    ids, first_beat = np.unique(beat_segment_ids, return_index=True)
 
-    # Pull out the segment start times
-    segment_beats = list(segment_beats)
-    segment_times_out = np.asarray(segment_times_out)[:, 0].squeeze().reshape((-1, 1))
-
-    if segment_times_out.ndim == 0:
-        segment_times_out = segment_times_out[np.newaxis]
+    segment_beats      = first_beat.tolist()
+    segment_times_out  = segment_intervals[ids, 0].reshape((-1, 1))
+    segment_labels_out = [segment_labels[i] for i in ids]
 
     return segment_beats, segment_times_out, segment_labels_out
 
@@ -71,37 +62,82 @@ def get_annotation(song, rootpath):
 
 # <codecell>
 
-def import_data(song, rootpath, output_path):
+def compute_features(song, annotation, y_sr=None):
+    '''Feature extraction and annotation alignment for a single song'''
+
+    X, B    = features(song, y_sr=y_sr)
+    Y, T, L = align_segmentation(annotation, B)
+
+    return X, B, Y, T, L
+
+# <codecell>
+
+def import_data(song, rootpath, output_path, compute, y_sr=None):
         data_file = '%s/features/SALAMI/%s.pickle' % (output_path, os.path.splitext(os.path.basename(song))[0])
 
-        if os.path.exists(data_file):
-            with open(data_file, 'r') as f:
-                Data = pickle.load(f)
-                print song, 'cached!'
-        else:
-            try:
-                X, B     = features(song)
-                Y, T, L  = align_segmentation(get_annotation(song, rootpath), B)
-                
-                Data = {'features': X, 
-                        'beats': B, 
-                        'filename': song, 
-                        'segment_times': T,
-                        'segment_labels': L,
-                        'segments': Y}
-                print song, 'processed!'
-        
-                with open(data_file, 'w') as f:
-                    pickle.dump( Data, f )
-            except Exception as e:
-                print song, 'failed!'
-                print e
-                Data = None
+        try:
+            X, B, Y, T, L = compute(song, get_annotation(song, rootpath), y_sr=y_sr)
+
+            Data = {'features': X,
+                    'beats': B,
+                    'filename': song,
+                    'segment_times': T,
+                    'segment_labels': L,
+                    'segments': Y}
+
+            # Materialize the per-song dict consumed by feature_segmenter
+            if not os.path.exists(data_file):
+                dump(Data, data_file, compress=3)
+
+            print(song, 'processed!')
+        except Exception as e:
+            print(song, 'failed!')
+            print(e)
+            Data = None
 
         return Data
 
 # <codecell>
 
+def import_chunk(songs, rootpath, output_path, compute):
+    '''Process a chunk of songs, decoding the next song's audio in a
+    background thread while the current song is being computed.'''
+
+    prefetched = {}
+
+    def prefetch(song):
+        def run():
+            try:
+                prefetched[song] = load_audio(song)
+            except Exception:
+                prefetched[song] = None
+
+        t = threading.Thread(target=run)
+        t.start()
+        return t
+
+    loader  = None
+    results = []
+    for i, song in enumerate(songs):
+        if loader is not None:
+            loader.join()
+
+        y_sr = prefetched.pop(song, None)
+
+        # Only decode ahead when the next song will actually be computed;
+        # on a warm cache the audio is never touched
+        loader = None
+        if i + 1 < len(songs):
+            next_song = songs[i + 1]
+            if not compute.check_call_in_cache(next_song, get_annotation(next_song, rootpath)):
+                loader = prefetch(next_song)
+
+        results.append(import_data(song, rootpath, output_path, compute, y_sr=y_sr))
+
+    return results
+
+# <codecell>
+
 def make_dataset(n=None, n_jobs=16, rootpath='SALAMI/', output_path='data/'):
     
 #    EXTS = ['mp3', 'wav', 'ogg', 'flac', 'm4a', 'aac']
@@ -113,19 +149,42 @@ def make_dataset(n=None, n_jobs=16, rootpath='SALAMI/', output_path='data/'):
     if n is None:
         n = len(files)
 
-    data = Parallel(n_jobs=n_jobs)(delayed(import_data)(song, rootpath, output_path) for song in files[:n])
-    
-    X, Y, B, T, F, L = [], [], [], [], [], []
-    for d in data:
-        if d is None:
-            continue
-        X.append(d['features'])
-        Y.append(d['segments'])
-        B.append(d['beats'])
-        T.append(d['segment_times'])
-        F.append(d['filename'])
-        L.append(d['segment_labels'])
+    # Memoize feature extraction on disk: cache hits come back through
+    # np.load with mmap_mode='r', so repeated runs and parallel workers
+    # share pages instead of re-reading full pickles
+    memory  = Memory(location='%s/features/SALAMI' % output_path, mmap_mode='r', verbose=0)
+    compute = memory.cache(compute_features, ignore=['y_sr'])
+
+    # loky workers survive across batches; max_nbytes/temp_folder memmap
+    # large *dispatched arguments* rather than results -- returned arrays
+    # only arrive as memmaps when Memory(mmap_mode='r') serves them from
+    # the cache.  (Same Parallel setup in the other make_*_train scripts.)
+    # One contiguous run of songs per worker, so each worker can overlap
+    # the next song's decode with the current song's compute while the
+    # gathered results keep the sorted song order
+    songs      = files[:n]
+    chunk_size = max(1, -(-len(songs) // n_jobs))
+    chunks     = [songs[i:i + chunk_size] for i in range(0, len(songs), chunk_size)]
+
+    data = Parallel(n_jobs=n_jobs,
+                    backend='loky',
+                    batch_size='auto',
+                    max_nbytes='1M',
+                    temp_folder='%s/jl_tmp' % output_path)(delayed(import_chunk)(chunk, rootpath, output_path, compute) for chunk in chunks)
+
+    data = [d for chunk in data for d in chunk]
     
+    # Gather the per-song results struct-of-lists style with a single
+    # transpose instead of six append loops
+    rows = [(d['features'], d['segments'], d['beats'],
+             d['segment_times'], d['filename'], d['segment_labels'])
+            for d in data if d is not None]
+
+    if not rows:
+        return [], [], [], [], [], []
+
+    X, Y, B, T, F, L = (list(_) for _ in zip(*rows))
+
     return X, Y, B, T, F, L
 
 
@@ -133,5 +192,6 @@ if __name__ == '__main__':
     salami_path = sys.argv[1]
     output_path = sys.argv[2]
     X, Y, B, T, F, L = make_dataset(rootpath=salami_path, output_path=output_path)
-    with open('%s/salami_data.pickle' % output_path, 'w') as f:
-        pickle.dump( (X, Y, B, T, F, L), f)
+    # Compressed binary dump: numpy arrays go through np.save rather
+    # than protocol-0 ASCII pickling
+    dump((X, Y, B, T, F, L), '%s/salami_data.pickle' % output_path, compress=3)
@@ -9,13 +9,18 @@ If run as a program, usage is:
 '''
 
 
+from __future__ import print_function
+
 import sys
 import os
 import argparse
 
 import numpy as np
-import scipy.signal
 import scipy.linalg
+import scipy.sparse.linalg
+import scipy.io.wavfile
+
+from joblib import Parallel, delayed
 
 # Requires librosa-develop 0.3 branch
 import librosa
@@ -34,19 +39,89 @@ N_MFCC      = 32
 N_CHROMA    = 12
 N_REP       = 32
 
-NOTE_MIN    = librosa.midi_to_hz(24) # 32Hz
-NOTE_NUM    = 84
-NOTE_RES    = 2                     # CQT filter resolution
-
 # mfcc, chroma, repetitions for each, and 4 time features
 __DIMENSION = N_MFCC + N_CHROMA + 2 * N_REP + 4
 
-def features(filename):
+def load_audio(filename):
+    '''Load a waveform at the analysis sample rate.
+
+    Plain PCM wav files are read directly with scipy.io.wavfile, skipping
+    the audioread/ffmpeg subprocess round-trip librosa.load goes through;
+    everything else (other extensions, compressed or 24-bit wavs that
+    scipy cannot parse) falls back to librosa.load.
+    '''
+
+    if os.path.splitext(filename)[-1].lower() != '.wav':
+        return librosa.load(filename, sr=SR)
+
+    try:
+        sr, y = scipy.io.wavfile.read(filename)
+    except Exception:
+        return librosa.load(filename, sr=SR)
+
+    # Convert PCM to float32 in [-1, 1]
+    if y.dtype == np.uint8:
+        y = (y.astype(np.float32) - 128.0) / 128.0
+    elif np.issubdtype(y.dtype, np.integer):
+        y = y.astype(np.float32) / float(1 << (8 * y.dtype.itemsize - 1))
+    else:
+        y = y.astype(np.float32)
+
+    # Down-mix to mono
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+
+    if sr != SR:
+        y = librosa.resample(y, sr, SR)
+
+    return y, SR
+
+def median_filter_rows(S, width):
+    '''Median-filter each row of S with a length-`width` window.
+
+    Equivalent to scipy.signal.medfilt2d(S, [1, width]) (zero-padded at
+    the edges), but evaluates all windows in one vectorized np.median
+    over a strided view instead of a per-window sort in a Python-visible
+    loop.
+    '''
+
+    pad = width // 2
+
+    padded = np.zeros((S.shape[0], S.shape[1] + 2 * pad), dtype=S.dtype)
+    padded[:, pad:pad + S.shape[1]] = S
+
+    shape   = (S.shape[0], S.shape[1], width)
+    strides = (padded.strides[0], padded.strides[1], padded.strides[1])
+    windows = np.lib.stride_tricks.as_strided(padded, shape=shape, strides=strides)
+
+    return np.median(windows, axis=-1)
+
+def log_normalize(S, ref_power=1.0, amin=1e-10, top_db=80.0):
+    '''In-place log-scaling of a spectrogram.
+
+    Matches librosa.logamplitude, but works in place instead of
+    allocating a full intermediate copy of the array.
+    '''
+
+    np.maximum(S, amin, out=S)
+    np.log10(S, out=S)
+    S *= 10.0
+    S -= 10.0 * np.log10(np.maximum(amin, ref_power))
+
+    np.maximum(S, S.max() - top_db, out=S)
+
+    return S
+
+def features(filename, y_sr=None):
     '''Feature-extraction for audio segmentation
     Arguments:
         filename -- str
         path to the input song
 
+        y_sr -- (ndarray, int) or None
+        optionally, a pre-loaded (waveform, sample rate) pair
+        at the analysis sample rate SR
+
     Returns:
         - X -- ndarray
             
@@ -67,39 +142,35 @@ def features(filename):
     
 
     def compress_data(X, k):
-        e_vals, e_vecs = scipy.linalg.eig(X.dot(X.T))
-        
-        e_vals = np.maximum(0.0, np.real(e_vals))
-        e_vecs = np.real(e_vecs)
-        
+        # The gram matrix is real symmetric PSD, so there is no need for a
+        # dense non-symmetric eig (complex arithmetic, all n eigenpairs):
+        # pull just the top k eigenpairs out with ARPACK
+        G = X.dot(X.T)
+
+        if k < G.shape[0] - 1:
+            e_vals, e_vecs = scipy.sparse.linalg.eigsh(G, k=k, which='LM')
+        else:
+            e_vals, e_vecs = scipy.linalg.eigh(G)
+
+        e_vals = np.maximum(0.0, e_vals)
+
         idx = np.argsort(e_vals)[::-1]
-        
+
         e_vals = e_vals[idx]
         e_vecs = e_vecs[:, idx]
-        
-        # Truncate to k dimensions
+
+        # Truncate to k dimensions (the dense fallback returns them all)
         if k < len(e_vals):
             e_vals = e_vals[:k]
             e_vecs = e_vecs[:, :k]
-        
+
         # Normalize by the leading singular value of X
         Z = np.sqrt(e_vals.max())
-        
+
         if Z > 0:
             e_vecs = e_vecs / Z
-        
-        return e_vecs.T.dot(X)
-
-    # Harmonic waveform
-    def harmonify(y):
-        D = librosa.stft(y)
-        return librosa.istft(librosa.decompose.hpss(D)[0])
 
-    # HPSS waveforms
-    def hpss_wav(y):
-        H, P = librosa.decompose.hpss(librosa.stft(y))
-
-        return librosa.istft(H), librosa.istft(P)
+        return e_vecs.T.dot(X)
 
     # Beats and tempo
     def get_beats(y):
@@ -115,63 +186,68 @@ def features(filename):
         
         return bpm, beats
 
-    # MFCC features
-    def get_mfcc(y):
+    # MFCC features, from a precomputed power spectrogram
+    def get_mfcc(S):
         # Generate a mel-spectrogram
-        S = librosa.feature.melspectrogram(y, sr,   n_fft=N_FFT, 
-                                                    hop_length=HOP_LENGTH, 
-                                                    n_mels=N_MELS, 
-                                                    fmax=FMAX).astype(np.float32)
-    
+        S = librosa.feature.melspectrogram(S=S, sr=sr,  n_mels=N_MELS,
+                                                        fmax=FMAX).astype(np.float32)
+
         # Put on a log scale
-        S = librosa.logamplitude(S, ref_power=S.max())
+        S = log_normalize(S, ref_power=S.max())
 
         return librosa.feature.mfcc(S=S, n_mfcc=N_MFCC)
 
-    # Chroma features
-    def chroma(y):
-        # Build the wrapper
-        CQT      = np.abs(librosa.cqt(y,    sr=SR, 
-                                            resolution=NOTE_RES,
-                                            hop_length=HOP_LENGTH,
-                                            fmin=NOTE_MIN,
-                                            n_bins=NOTE_NUM))
-
-        C_to_Chr = librosa.filters.cq_to_chroma(CQT.shape[0], n_chroma=N_CHROMA) 
-
-        return librosa.logamplitude(librosa.util.normalize(C_to_Chr.dot(CQT)))
+    # Chroma features, from a precomputed magnitude spectrogram
+    def chroma(S):
+        return log_normalize(librosa.feature.chromagram(S=S.astype(np.float32),
+                                                        sr=SR,
+                                                        n_chroma=N_CHROMA))
 
     # Latent factor repetition features
     def repetition(X, metric='seuclidean'):
-        R = librosa.segment.recurrence_matrix(X, 
-                                            k=2 * int(np.ceil(np.sqrt(X.shape[1]))), 
-                                            width=REP_WIDTH, 
+        # The latent factors are insensitive to small numerical noise, so
+        # run the whole recurrence -> filter -> eig chain in float32:
+        # everything downstream works at the input's dtype
+        X = np.asarray(X, dtype=np.float32)
+
+        R = librosa.segment.recurrence_matrix(X,
+                                            k=2 * int(np.ceil(np.sqrt(X.shape[1]))),
+                                            width=REP_WIDTH,
                                             metric=metric,
                                             sym=False).astype(np.float32)
 
-        P = scipy.signal.medfilt2d(librosa.segment.structure_feature(R), [1, REP_FILTER])
-        
-        # Discard empty rows.  
+        S = librosa.segment.structure_feature(R)
+
+        # The kNN mask leaves most lag rows empty, and an all-zero row stays
+        # all-zero under the median filter, so only filter the occupied rows
+        P = median_filter_rows(S[S.any(axis=1)], REP_FILTER)
+
+        # Discard empty rows.
         # This should give an equivalent SVD, but resolves some numerical instabilities.
         P = P[P.any(axis=1)]
 
         return compress_data(P, N_REP)
 
 
-    print '\t[1/6] loading audio'
-    # Load the waveform
-    y, sr = librosa.load(filename, sr=SR)
+    print('\t[1/6] loading audio')
+    # Load the waveform, unless the caller already did
+    if y_sr is None:
+        y, sr = load_audio(filename)
+    else:
+        y, sr = y_sr
 
     # Compute duration
     duration = float(len(y)) / sr
 
-    print '\t[2/6] Separating harmonic and percussive signals'
-    # Separate signals
-    y_harm, y_perc = hpss_wav(y)
+    print('\t[2/6] Separating harmonic and percussive signals')
+    # Compute the STFT once, and split it into harmonic and percussive
+    # components; only the percussive part goes back to the time domain,
+    # since beat tracking needs a waveform
+    D      = librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)
+    H, P   = librosa.decompose.hpss(D)
+    y_perc = librosa.istft(P, hop_length=HOP_LENGTH)
 
-    
-    
-    print '\t[3/6] detecting beats'
+    print('\t[3/6] detecting beats')
     # Get the beats
     bpm, beats = get_beats(y_perc)
 
@@ -185,16 +261,16 @@ def features(filename):
     # Stash beat times aligned to the longer hop lengths
     B = librosa.frames_to_time(beat_frames, sr=SR, hop_length=HOP_LENGTH)
 
-    print '\t[4/6] generating MFCC'
-    # Get the MFCCs
-    M = get_mfcc(y)
+    print('\t[4/6] generating MFCC')
+    # Get the MFCCs from the full mixture spectrogram
+    M = get_mfcc(np.abs(D)**2)
 
     # Beat-synchronize the features
     M = librosa.feature.sync(M, beat_frames, aggregate=np.mean)
-    
-    print '\t[5/6] generating chroma'
-    # Get the chroma from the harmonic component
-    C = chroma(y_harm)
+
+    print('\t[5/6] generating chroma')
+    # Get the chroma from the harmonic-masked spectrogram
+    C = chroma(np.abs(H))
 
     # Beat-synchronize the features
     C = librosa.feature.sync(C, beat_frames, aggregate=np.median)
@@ -203,12 +279,13 @@ def features(filename):
     N = np.arange(float(len(beat_frames)))
     
     # Beat-synchronous repetition features
-    print '\t[6/6] generating structure features'
+    print('\t[6/6] generating structure features')
     R_timbre = repetition(librosa.feature.stack_memory(M))
     R_chroma = repetition(librosa.feature.stack_memory(C))
     
-    # Stack it all up
-    X = np.vstack([M, C, R_timbre, R_chroma, B, B / duration, N, N / len(beats)])
+    # Stack it all up, in float32 so the downstream projection and
+    # distance computations stay on the single-precision BLAS path
+    X = np.vstack([M, C, R_timbre, R_chroma, B, B / duration, N, N / len(beats)]).astype(np.float32)
 
     # Add on the end-of-track timestamp
     B = np.concatenate([B, [duration]])
@@ -218,56 +295,100 @@ def features(filename):
 def gaussian_cost(X):
     '''Return the average log-likelihood of data under a standard normal
     '''
-    
+
     d, n = X.shape
-    
+
     if n < 2:
         return 0
-    
+
     sigma = np.var(X, axis=1, ddof=1)
-    
-    cost =  -0.5 * d * n * np.log(2. * np.pi) - 0.5 * (n - 1.) * np.sum(sigma) 
+
+    cost =  -0.5 * d * n * np.log(2. * np.pi) - 0.5 * (n - 1.) * np.sum(sigma)
     return cost
-    
-def clustering_cost(X, boundaries):
-    
+
+def prefix_sums(X):
+    '''Prefix sums of X and X**2 along the time axis, for O(d) segment
+    variance lookups in clustering_cost.
+    '''
+
+    d = X.shape[0]
+    zero = np.zeros((d, 1))
+
+    csum   = np.concatenate([zero, np.cumsum(X, axis=1, dtype=np.float64)], axis=1)
+    csumsq = np.concatenate([zero, np.cumsum(X**2, axis=1, dtype=np.float64)], axis=1)
+
+    return csum, csumsq
+
+def clustering_cost(X, boundaries, sums=None):
+
     # Boundaries include beginning and end frames, so k is one less
     k = len(boundaries) - 1
-    
-    d, n = map(float, X.shape)
-    
+
+    d, n = float(X.shape[0]), float(X.shape[1])
+
     # Compute the average log-likelihood of each cluster
-    cost = [gaussian_cost(X[:, start:end]) for (start, end) in zip(boundaries[:-1], 
-                                                                    boundaries[1:])]
-    
+    if sums is None:
+        cost = [gaussian_cost(X[:, start:end]) for (start, end) in zip(boundaries[:-1],
+                                                                        boundaries[1:])]
+    else:
+        # All segments at once from the prefix sums: one fancy-indexed
+        # diff per array, no Python-level loop over segments
+        csum, csumsq = sums
+
+        b       = np.asarray(boundaries)
+        lengths = np.diff(b).astype(float)
+        valid   = lengths >= 2
+
+        seg_sum   = np.diff(csum[:, b], axis=1)[:, valid]
+        seg_sumsq = np.diff(csumsq[:, b], axis=1)[:, valid]
+
+        lengths = lengths[valid]
+        sigma   = (seg_sumsq - seg_sum**2 / lengths) / (lengths - 1.)
+
+        # Segments shorter than 2 frames contribute zero, as in gaussian_cost
+        cost = (-0.5 * d * lengths * np.log(2. * np.pi)
+                - 0.5 * (lengths - 1.) * sigma.sum(axis=0))
+
     cost = - 2 * np.sum(cost) / n + 2 * ( d * k )
 
     return cost
 
-def get_k_segments(X, k):
-    
+def get_k_segments(X, k, sums=None):
+
     # Step 1: run ward
     boundaries = librosa.segment.agglomerative(X, k)
-    
+
     boundaries = np.unique(np.concatenate(([0], boundaries, [X.shape[1]])))
-    
+
     # Step 2: compute cost
-    cost = clustering_cost(X, boundaries)
-        
+    cost = clustering_cost(X, boundaries, sums=sums)
+
     return boundaries, cost
 
-def get_segments(X, kmin=8, kmax=32):
-    
+def get_segments(X, kmin=8, kmax=32, n_jobs=-1):
+
+    # Share one pass over X across the whole sweep: every per-segment
+    # variance below becomes a prefix-sum lookup
+    sums = prefix_sums(X)
+
+    # Each candidate segmentation is independent, and the clustering and
+    # cost computations spend their time inside numpy/scipy routines that
+    # release the GIL, so evaluate them with a thread pool.  Callers that
+    # already parallelize over songs should pass n_jobs=1 here to avoid
+    # oversubscription.
+    results = Parallel(n_jobs=n_jobs, backend='threading')(delayed(get_k_segments)(X, k, sums)
+                                                            for k in range(kmax, kmin, -1))
+
+    # Keep the serial semantics: stop at the first cost increase
     cost_min = np.inf
     S_best = []
-    for k in range(kmax, kmin, -1):
-        S, cost = get_k_segments(X, k)
+    for S, cost in results:
         if cost < cost_min:
             cost_min = cost
             S_best = S
         else:
             break
-            
+
     return S_best
 
 def save_segments(outfile, S, beats):
@@ -304,9 +425,11 @@ def process_arguments():
 def load_transform(transform_file):
 
     if transform_file is None:
-        W = np.eye(__DIMENSION)
+        W = np.eye(__DIMENSION, dtype=np.float32)
     else:
-        W = np.load(transform_file)
+        # Models trained via the generalized eig carry a numerically-zero
+        # imaginary part; drop it and project in single precision
+        W = np.ascontiguousarray(np.real(np.load(transform_file)), dtype=np.float32)
 
     return W
 
@@ -321,22 +444,22 @@ if __name__ == '__main__':
     parameters = process_arguments()
 
     # Load the features
-    print '- ', os.path.basename(parameters['input_song'])
+    print('- ', os.path.basename(parameters['input_song']))
 
     X, beats    = features(parameters['input_song'])
 
     # Load the transformation
     W           = load_transform(parameters['transform'])
-    print '\tapplying transformation...'
+    print('\tapplying transformation...')
     X           = W.dot(X)
 
     # Find the segment boundaries
-    print '\tpredicting segments...'
+    print('\tpredicting segments...')
     kmin, kmax  = get_num_segs(beats[-1])
     S           = get_segments(X, kmin=kmin, kmax=kmax)
 
     # Output lab file
-    print '\tsaving output to ', parameters['output_file']
+    print('\tsaving output to ', parameters['output_file'])
     save_segments(parameters['output_file'], S, beats)
 
     pass